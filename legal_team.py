@@ -2,19 +2,235 @@
 import os
 import streamlit as st
 import asyncio
-import tempfile
+import hashlib
+import numpy as np
+import orjson
+from collections import OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from threading import Lock, Thread
+from uuid import uuid4
+from chromadb.config import Settings
 from agno.agent import Agent
+from agno.run.agent import RunEvent
 from agno.models.google import Gemini
 from agno.models.xai import xAI
 from agno.tools.duckduckgo import DuckDuckGoTools
 from agno.vectordb.chroma import ChromaDb
 from agno.knowledge.knowledge import Knowledge
+from agno.knowledge.content import Content, ContentStatus, FileData
+from agno.knowledge.document import Document
 from agno.knowledge.reader.pdf_reader import PDFReader
 from agno.knowledge.chunking.document import DocumentChunking
 from agno.knowledge.embedder.google import GeminiEmbedder
 from agno.db.json.json_db import JsonDb
 
 
+
+@dataclass
+class BatchGeminiEmbedder(GeminiEmbedder):
+    """GeminiEmbedder that embeds many texts per request instead of one."""
+
+    # Gemini accepts at most 100 contents per embed_content call
+    batch_size: int = 100
+    max_concurrency: int = 4
+
+    # Progress counters of the ingestion running in the current context, if any
+    progress = ContextVar("ingest_progress", default=None)
+
+    def _batch_request_params(self, texts):
+        _id = self.id.split("/")[-1] if self.id.startswith("models/") else self.id
+        config = {}
+        if self.dimensions:
+            config["output_dimensionality"] = self.dimensions
+        if self.task_type:
+            config["task_type"] = self.task_type
+        request_params = {"model": _id, "contents": texts}
+        if config:
+            request_params["config"] = config
+        if self.request_params:
+            request_params.update(self.request_params)
+        return request_params
+
+    async def async_embed_documents(self, texts):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                response = await self.aclient.aio.models.embed_content(**self._batch_request_params(batch))
+            progress = self.progress.get()
+            if progress is not None:
+                progress["done"] += 1
+            return [e.values for e in response.embeddings or []]
+
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        progress = self.progress.get()
+        if progress is not None:
+            progress["total"] += len(batches)
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [embedding for batch in results for embedding in batch]
+
+
+class BatchChromaDb(ChromaDb):
+    """ChromaDb that embeds all chunks of a document in batched requests before writing them."""
+
+    # HNSW index settings applied when the collection is first created
+    hnsw_params = {"hnsw:construction_ef": 200, "hnsw:M": 32, "hnsw:search_ef": 80}
+    # Documents with fewer chunks are searched by brute force in memory instead of through HNSW
+    small_doc_max_chunks = 2000
+    # Most recently used documents whose matrices are kept in memory
+    small_docs_max = 16
+    # Rows of the float16 matrix widened to float32 at a time when scoring a query
+    score_block_rows = 256
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Document name -> (unit-norm float16 embedding matrix, ids, contents, metadatas), oldest first
+        self.small_docs = OrderedDict()
+        # Ingestion writes and agent searches touch the cache from different threads
+        self.small_docs_lock = Lock()
+
+    def create(self):
+        if self.exists():
+            self._collection = self.client.get_collection(name=self.collection_name)
+        else:
+            self._collection = self.client.create_collection(
+                name=self.collection_name, metadata={"hnsw:space": self.distance.value, **self.hnsw_params}
+            )
+
+    async def _embed_documents(self, documents):
+        if isinstance(self.embedder, BatchGeminiEmbedder):
+            embeddings = await self.embedder.async_embed_documents([document.content for document in documents])
+            if len(embeddings) != len(documents):
+                raise ValueError(
+                    f"Gemini returned {len(embeddings)} embeddings for {len(documents)} chunks; nothing was stored."
+                )
+            for document, embedding in zip(documents, embeddings):
+                document.embedding = embedding
+        else:
+            await asyncio.gather(*(document.async_embed(embedder=self.embedder) for document in documents))
+
+    def _prepare_documents(self, content_hash, documents, filters=None):
+        ids, docs, docs_embeddings, docs_metadata = [], [], [], []
+        for document in documents:
+            cleaned_content = document.content.replace("\x00", "\ufffd")
+            metadata = document.meta_data or {}
+            if filters:
+                metadata.update(filters)
+            if document.name is not None:
+                metadata["name"] = document.name
+            if document.content_id is not None:
+                metadata["content_id"] = document.content_id
+            metadata["content_hash"] = content_hash
+
+            # Key chunks by their document too, so identical text in another upload is not overwritten
+            ids.append(hashlib.md5(f"{content_hash}:{cleaned_content}".encode()).hexdigest())
+            docs.append(cleaned_content)
+            docs_embeddings.append(document.embedding)
+            docs_metadata.append(metadata)
+        return ids, docs, docs_embeddings, docs_metadata
+
+    def _write_documents(self, write, ids, docs, docs_embeddings, docs_metadata):
+        # One call per document; only split when Chroma's own batch limit would be exceeded
+        batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            write(
+                ids=ids[start:end],
+                embeddings=docs_embeddings[start:end],
+                documents=docs[start:end],
+                metadatas=docs_metadata[start:end],
+            )
+
+    def _keep_in_memory(self, filters, ids, docs, docs_embeddings, docs_metadata):
+        doc = (filters or {}).get("doc")
+        if not doc:
+            return
+        if not ids or len(ids) >= self.small_doc_max_chunks or not all(docs_embeddings):
+            with self.small_docs_lock:
+                self.small_docs.pop(doc, None)
+            return
+        matrix = np.asarray(docs_embeddings, dtype=np.float32)
+        matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+        # Unit-norm vectors lose almost nothing in float16, and the matrix takes half the memory
+        entry = (matrix.astype(np.float16), ids, docs, [dict(metadata) for metadata in docs_metadata])
+        with self.small_docs_lock:
+            self.small_docs[doc] = entry
+            self.small_docs.move_to_end(doc)
+            while len(self.small_docs) > self.small_docs_max:
+                self.small_docs.popitem(last=False)
+
+    def _store_documents(self, write_method, content_hash, documents, filters):
+        if not self._collection:
+            self._collection = self.client.get_collection(name=self.collection_name)
+        prepared = self._prepare_documents(content_hash, documents, filters)
+        self._write_documents(getattr(self._collection, write_method), *prepared)
+        self._keep_in_memory(filters, *prepared)
+
+    # Only the embedding requests run on the event loop; blocking Chroma calls go to a thread
+    async def async_upsert(self, content_hash, documents, filters=None):
+        if await asyncio.to_thread(self.content_hash_exists, content_hash):
+            await asyncio.to_thread(self._delete_by_content_hash, content_hash)
+        await self._async_upsert(content_hash, documents, filters)
+
+    async def _async_upsert(self, content_hash, documents, filters=None):
+        await self._embed_documents(documents)
+        await asyncio.to_thread(self._store_documents, "upsert", content_hash, documents, filters)
+
+    async def async_insert(self, content_hash, documents, filters=None):
+        await self._embed_documents(documents)
+        await asyncio.to_thread(self._store_documents, "add", content_hash, documents, filters)
+
+    def search(self, query, limit=5, filters=None):
+        # A search scoped to one small document is a single matrix-vector product
+        doc = filters.get("doc") if filters and set(filters) == {"doc"} else None
+        if isinstance(doc, dict):
+            doc = doc.get("$eq")
+        with self.small_docs_lock:
+            entry = self.small_docs.get(doc) if isinstance(doc, str) else None
+            if entry is not None:
+                self.small_docs.move_to_end(doc)
+        if entry is None:
+            return super().search(query, limit, filters)
+
+        matrix, ids, docs, metadatas = entry
+        query_embedding = self.embedder.get_embedding(query)
+        if not query_embedding:
+            return []
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+
+        # Score in row blocks so a query never allocates a full float32 copy of the matrix
+        scores = np.empty(len(ids), dtype=np.float32)
+        for start in range(0, len(ids), self.score_block_rows):
+            end = start + self.score_block_rows
+            scores[start:end] = matrix[start:end].astype(np.float32) @ query_vector
+        k = min(limit, len(ids))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+
+        search_results = []
+        for idx in top:
+            metadata = dict(metadatas[idx])
+            name = metadata.pop("name", None)
+            content_id = metadata.pop("content_id", None)
+            metadata["distances"] = float(1.0 - scores[idx])
+            search_results.append(
+                Document(
+                    id=ids[idx],
+                    name=name,
+                    meta_data=metadata,
+                    content=docs[idx],
+                    embedding=matrix[idx].astype(np.float32).tolist(),
+                    content_id=content_id,
+                )
+            )
+        if self.reranker:
+            search_results = self.reranker.rerank(query=query, documents=search_results)
+        return search_results
+
+
 # Initialize Streamlit
 # Customizing the page title and header
 st.set_page_config(page_title="AI Legal Team Agents", page_icon="⚖️", layout="wide")
@@ -31,35 +247,217 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if "vector_db" not in st.session_state:
+def _content(response):
+    # Prefer the response text over str(), which renders agno's whole run output
+    if isinstance(response, str):
+        return response
+    content = getattr(response, "content", None) or getattr(response, "text", None)
+    if content is None and getattr(response, "messages", None):
+        content = response.messages[-1].content
+    if content is None:
+        return ""
+    return content if isinstance(content, str) else str(content)
+
+
+def chroma_settings():
+    # Skip Chroma's anonymized telemetry requests. A fresh object per client, because
+    # PersistentClient writes its persist_directory into the Settings it is given.
+    return Settings(anonymized_telemetry=False)
+
+
+# Shared resources survive Streamlit reruns instead of being rebuilt on every interaction
+@st.cache_resource
+def get_loop():
+    # One long-lived event loop, so cached agents and their async clients never see a closed loop
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+@st.cache_resource
+def get_vector_db():
     # Ensure persistent storage directory exists for ChromaDB
     os.makedirs("tmp/chromadb", exist_ok=True)
     try:
-        st.session_state.vector_db = ChromaDb(
+        vector_db = BatchChromaDb(
             collection="law",
             path="tmp/chromadb",
             persistent_client=True,
-            embedder=GeminiEmbedder(),
+            embedder=BatchGeminiEmbedder(),
             tenant="default",
             database="default",
+            settings=chroma_settings(),
         )
         # Touch client to trigger initialization early
-        _ = st.session_state.vector_db.client
+        _ = vector_db.client
     except Exception:
         # Fallback to ephemeral client to keep the app usable
-        st.session_state.vector_db = ChromaDb(
+        vector_db = BatchChromaDb(
             collection="law",
             persistent_client=False,
-            embedder=GeminiEmbedder(),
+            embedder=BatchGeminiEmbedder(),
+            settings=chroma_settings(),
         )
+    return vector_db
 
-if "knowledge_base" not in st.session_state:
-    st.session_state.knowledge_base = None
+
+def count_doc_chunks(name):
+    # Count only the chunks tagged with this document, not the whole shared collection
+    collection = get_vector_db().client.get_or_create_collection("law")
+    return len(collection.get(where={"doc": name}, include=[])["ids"])
+
+
+@st.cache_resource
+def get_knowledge_base(kb_id):
+    # Ensure contents DB directory exists
+    os.makedirs("tmp/contents_db", exist_ok=True)
+    try:
+        # Prefer a stable name for the knowledge base to enable contents DB
+        return Knowledge(
+            vector_db=get_vector_db(),
+            name=kb_id,
+            contents_db=JsonDb(db_path="tmp/contents_db", knowledge_table=kb_id)
+        )
+    except TypeError:
+        # Fallback for older/newer API variants
+        try:
+            return Knowledge(
+                vector_db=get_vector_db(),
+                knowledge_base=kb_id,
+                contents_db=JsonDb(db_path="tmp/contents_db", knowledge_table=kb_id)
+            )
+        except TypeError:
+            return Knowledge(
+                vector_db=get_vector_db(),
+                contents_db=JsonDb(db_path="tmp/contents_db", knowledge_table=kb_id)
+            )
+
+
+async def _load_pdf_bytes(knowledge_base, content, progress):
+    embedder = knowledge_base.vector_db.embedder
+    if isinstance(getattr(embedder, "progress", None), ContextVar):
+        embedder.progress.set(progress)
+    # The content hash is derived from the file name alone, so never skip: a re-upload under the
+    # same name replaces the stored chunks instead of silently keeping the old document
+    await knowledge_base._load_content(content, upsert=True, skip_if_exists=False)
+
+
+def add_pdf_bytes(knowledge_base, name, data, reader, progress=None):
+    # Hand the uploaded bytes straight to the reader instead of round-tripping through a temp file
+    content = Content(
+        id=str(uuid4()),
+        name=name,
+        file_data=FileData(content=data, type="application/pdf", filename=name, size=len(data)),
+        # Tag every chunk with its source document so searches can be scoped to it
+        metadata={"doc": name},
+        reader=reader,
+    )
+    # Runs on the ingest worker's own event loop, so reading, chunking and Chroma writes never hold the agents' loop
+    asyncio.get_event_loop().run_until_complete(_load_pdf_bytes(knowledge_base, content, progress))
+    if content.status == ContentStatus.FAILED:
+        raise ValueError(content.status_message or "The document could not be stored.")
+
+    # Earlier uploads under this name had their chunks replaced above; drop their contents rows too
+    contents, _ = knowledge_base.get_content()
+    for previous in contents:
+        if previous.name == name and previous.id != content.id:
+            knowledge_base.remove_content_by_id(previous.id)
+
+
+@st.cache_resource
+def get_ingest_executor():
+    # A single worker keeps ingestions ordered while the script thread stays free.
+    # It owns an event loop for the ingestions, separate from the one the agents run on.
+    return ThreadPoolExecutor(max_workers=1, initializer=asyncio.set_event_loop, initargs=(asyncio.new_event_loop(),))
+
+
+@st.fragment(run_every=1)
+def show_ingest_status():
+    ingest = st.session_state.get("ingest")
+    if not ingest:
+        return
+
+    future, progress = ingest["future"], ingest["progress"]
+    if not future.done():
+        if progress["total"]:
+            st.progress(
+                progress["done"] / progress["total"],
+                text=f"Embedding document... batch {progress['done']}/{progress['total']}"
+            )
+        else:
+            st.progress(0, text="Reading document...")
+        return
+
+    del st.session_state.ingest
+    messages = []
+    failed = True
+    try:
+        future.result()
+
+        # Verify content was added
+        # Count stored chunks rather than running an embedding + ANN search
+        chunk_count = count_doc_chunks(ingest["name"])
+        if chunk_count > 0:
+            messages.append(("success", f"✅ Document processed and stored in knowledge base! Found {chunk_count} chunks."))
+            st.session_state.processed_files.add(ingest["name"])
+            st.session_state.current_doc = ingest["name"]
+            st.session_state.kb_id = "law"
+            st.session_state.kb_version += 1
+            st.session_state.specialist_outputs.clear()
+            failed = False
+        else:
+            messages.append(("warning", "⚠️ Document uploaded but no content found in search. Check if PDF is readable."))
+
+    except Exception as e:
+        messages.append(("error", f"Error processing document: {e}"))
+
+    if failed:
+        # Keep the error on screen and don't resubmit this upload; uploading again gives a new file_id
+        st.session_state.failed_uploads[ingest["file_id"]] = messages
+    else:
+        st.session_state.ingest_messages = messages
+    # Rerun the whole app so the analysis section picks up the new document
+    st.rerun()
+
+
+# Most recent team lead outputs kept for all sessions
+LLM_CACHE_SIZE = 256
+
+
+@st.cache_resource
+def get_llm_cache():
+    # Exact-prompt cache for team lead outputs; only touched from the background event loop
+    return OrderedDict()
+
+
+vector_db = get_vector_db()
+
+# Initialize session state
+if "kb_id" not in st.session_state:
+    st.session_state.kb_id = None
+
+# Bumped on every ingest so memoized specialist outputs never outlive the documents they came from
+if "kb_version" not in st.session_state:
+    st.session_state.kb_version = 0
+
+if "specialist_outputs" not in st.session_state:
+    st.session_state.specialist_outputs = OrderedDict()
+
+# Searches are restricted to the most recently selected document
+if "current_doc" not in st.session_state:
+    st.session_state.current_doc = None
 
 if "processed_files" not in st.session_state:
     st.session_state.processed_files = set()
 
+# Uploads whose ingestion failed, by uploader file_id, with the messages to keep showing
+if "failed_uploads" not in st.session_state:
+    st.session_state.failed_uploads = {}
+
 # Initialize chat history
 if "chat_messages" not in st.session_state:
     st.session_state.chat_messages = []
@@ -90,80 +488,70 @@ with st.sidebar:
     chunk_size_in = st.sidebar.number_input("Chunk Size", min_value=1, max_value=5000, value=1000)
     overlap_in = st.sidebar.number_input("Overlap", min_value=1, max_value=1000, value=200)
 
+    # Web search adds an external round-trip per researcher call, so it is opt-in
+    use_web = st.sidebar.checkbox("Allow DuckDuckGo web search", value=False)
+
     st.header("📄 Document Upload")
 
     uploaded_file = st.file_uploader("Upload a Legal Document (PDF)", type=["pdf"])
     
     if uploaded_file:
-        if uploaded_file.name not in st.session_state.processed_files:
-            with st.spinner("Processing document..."):
-                try:
-                    # Save to a temp file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                        temp_file.write(uploaded_file.getvalue())
-                        temp_path = temp_file.name
-                    
-                    # Process the uploaded document into knowledge base
-                    # Ensure contents DB directory exists
-                    os.makedirs("tmp/contents_db", exist_ok=True)
-                    try:
-                        # Prefer a stable name for the knowledge base to enable contents DB
-                        st.session_state.knowledge_base = Knowledge(
-                            vector_db=st.session_state.vector_db,
-                            name="law",
-                            contents_db=JsonDb(db_path="tmp/contents_db", knowledge_table="law")
-                        )
-                    except TypeError:
-                        # Fallback for older/newer API variants
-                        try:
-                            st.session_state.knowledge_base = Knowledge(
-                                vector_db=st.session_state.vector_db,
-                                knowledge_base="law",
-                                contents_db=JsonDb(db_path="tmp/contents_db", knowledge_table="law")
-                            )
-                        except TypeError:
-                            st.session_state.knowledge_base = Knowledge(
-                                vector_db=st.session_state.vector_db,
-                                contents_db=JsonDb(db_path="tmp/contents_db", knowledge_table="law")
-                            )
-                    
-                    # Add content to knowledge base
-                    st.session_state.knowledge_base.add_content(
-                        reader=PDFReader(
-                            chunking_strategy=DocumentChunking(chunk_size=chunk_size_in, overlap=overlap_in)
-                        ),
-                        path=temp_path
-                    )
-
-                    # Verify content was added
-                    try:
-                        # Try to search the knowledge base to verify content
-                        search_results = st.session_state.knowledge_base.search("contract")
-                        if search_results:
-                            st.success(f"✅ Document processed and stored in knowledge base! Found {len(search_results)} chunks.")
-                        else:
-                            st.warning("⚠️ Document uploaded but no content found in search. Check if PDF is readable.")
-                    except Exception as search_error:
-                        st.success("✅ Document processed and stored in knowledge base!")
-                        st.info(f"Note: Could not verify content ({search_error})")
-
-                    st.session_state.processed_files.add(uploaded_file.name)
-                    
-                    # Clean up temp file
-                    try:
-                        os.unlink(temp_path)
-                    except:
-                        pass
-
-                except Exception as e:
-                    st.error(f"Error processing document: {e}")
-                    
+        if uploaded_file.name in st.session_state.processed_files:
+            st.session_state.current_doc = uploaded_file.name
+
+        failed_messages = st.session_state.failed_uploads.get(uploaded_file.file_id)
+        for kind, message in failed_messages or []:
+            getattr(st, kind)(message)
+
+        ingest = st.session_state.get("ingest")
+        if uploaded_file.name not in st.session_state.processed_files and not ingest and not failed_messages:
+            # Process the uploaded document into knowledge base in the background
+            progress = {"done": 0, "total": 0}
+            future = get_ingest_executor().submit(
+                add_pdf_bytes,
+                get_knowledge_base("law"),
+                name=uploaded_file.name,
+                data=uploaded_file.getvalue(),
+                reader=PDFReader(
+                    chunking_strategy=DocumentChunking(chunk_size=chunk_size_in, overlap=overlap_in)
+                ),
+                progress=progress,
+            )
+            st.session_state.ingest = {
+                "name": uploaded_file.name, "file_id": uploaded_file.file_id, "future": future, "progress": progress
+            }
+
+    # Only poll while an ingestion is running
+    if st.session_state.get("ingest"):
+        show_ingest_status()
+
+    for kind, message in st.session_state.pop("ingest_messages", []):
+        getattr(st, kind)(message)
+
+def current_doc_filter():
+    # Chroma metadata filter for the document the user is working on
+    return {"doc": st.session_state.current_doc} if st.session_state.current_doc else {}
+
+
+# Most recent specialist answers kept per session
+SPECIALIST_CACHE_SIZE = 64
+
+# Sections the team lead returns from a single structured call
+BREAKDOWN_FIELDS = ["client_view", "issuing_view", "critical_clauses", "strengths", "weaknesses", "recommendations"]
+BREAKDOWN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {field: {"type": "STRING"} for field in BREAKDOWN_FIELDS},
+    "required": BREAKDOWN_FIELDS,
+}
+
 # Initialize AI Agents (After Document Upload)
-if st.session_state.knowledge_base:
+def build_agents(kb_id, use_web):
+    knowledge_base = get_knowledge_base(kb_id)
+
     legal_researcher = Agent(
         name="LegalAdvisor",
         model=Gemini(id="gemini-2.5-flash"),
-        knowledge=st.session_state.knowledge_base,
+        knowledge=knowledge_base,
         search_knowledge=True,
         description="Legal Researcher AI - Finds and cites relevant legal cases, regulations, and precedents using all data in the knowledge base.",
         instructions=[
@@ -174,16 +562,15 @@ if st.session_state.knowledge_base:
         "Highlight critical points that must not be missed.",
         "Summarize in a way that is easy to read, clear, and actionable, without losing essential detail.",
         "Always cite sources and document references clearly.",
-        "If needed, use DuckDuckGo for additional legal references."
-        ], 
-        tools=[DuckDuckGoTools()],
+        ] + (["If needed, use DuckDuckGo for additional legal references."] if use_web else []),
+        tools=[DuckDuckGoTools()] if use_web else [],
         markdown=True
     )
 
     contract_analyst = Agent(
         name="ContractAnalyst",
         model=Gemini(id="gemini-2.5-flash"),
-        knowledge=st.session_state.knowledge_base,
+        knowledge=knowledge_base,
         search_knowledge=True,
         description="Contract Analyst AI - Reviews contracts and identifies key clauses, risks, and obligations using the full document data.",
         instructions=[
@@ -200,7 +587,7 @@ if st.session_state.knowledge_base:
     legal_strategist = Agent(
         name="LegalStrategist",
         model=Gemini(id="gemini-2.5-flash"),
-        knowledge=st.session_state.knowledge_base,
+        knowledge=knowledge_base,
         search_knowledge=True,
         description="Legal Strategist AI - Provides comprehensive risk assessment and strategic recommendations based on all the available data from the contract.",
         instructions=[
@@ -227,34 +614,153 @@ if st.session_state.knowledge_base:
         ],
         markdown=True
     )
+
+    # Same team lead, constrained to return the post-processing sections as one JSON object
+    breakdown_lead = Agent(
+        name="teamlead",
+        model=Gemini(
+            id="gemini-2.5-flash",
+            generation_config={"response_mime_type": "application/json", "response_schema": BREAKDOWN_SCHEMA},
+        ),
+        description="Team Lead AI - Splits an integrated legal analysis into party perspectives, clauses, strengths, weaknesses, and recommendations.",
+        instructions=[
+        "Filter and prioritize the analysis you are given. Include only the most critical insights.",
+        "Write in the tone of a top lawyer: sharp, concise, and meaningful. No fluff, no robotic repetition.",
+        "Respond only with the requested JSON object."
+        ],
+    )
+    return legal_researcher, contract_analyst, legal_strategist, team_lead, breakdown_lead
+
+
+def get_agents(kb_id, use_web):
+    # agno keeps per-run state on the agent (the stream flag, tools bound to the run's knowledge
+    # filters), so agents are kept per session rather than shared across sessions
+    key = (kb_id, use_web)
+    agents = st.session_state.get("agents")
+    if not agents or agents[0] != key:
+        agents = (key, build_agents(kb_id, use_web))
+        st.session_state.agents = agents
+    return agents[1]
+
+
+if st.session_state.kb_id:
+    legal_researcher, contract_analyst, legal_strategist, team_lead, breakdown_lead = get_agents(st.session_state.kb_id, use_web)
+
+    async def run_specialist(agent, query, memo, kb_version, doc_filter):
+        # Repeat queries against an unchanged knowledge base reuse the earlier answer
+        key = (agent.name, bool(agent.tools), query, kb_version, doc_filter.get("doc"))
+        if key in memo:
+            memo.move_to_end(key)
+            return memo[key]
+        # A streamed chat run leaves agent.stream set, so always ask for a complete response here
+        response = await agent.arun(query, stream=False, knowledge_filters=doc_filter or None)
+        content = _content(response)
+        memo[key] = content
+        while len(memo) > SPECIALIST_CACHE_SIZE:
+            memo.popitem(last=False)
+        return content
+
+    async def get_team_response_async(query, memo, kb_version, doc_filter):
+        # The integrated report is memoized like the specialist answers it is built from
+        key = (team_lead.name, bool(legal_researcher.tools), query, kb_version, doc_filter.get("doc"))
+        if key in memo:
+            memo.move_to_end(key)
+            return memo[key]
+
+        # The three specialists are independent, so run them concurrently
+        research_response, contract_response, strategy_response = await asyncio.gather(
+            run_specialist(legal_researcher, query, memo, kb_version, doc_filter),
+            run_specialist(contract_analyst, query, memo, kb_version, doc_filter),
+            run_specialist(legal_strategist, query, memo, kb_version, doc_filter),
+        )
+
+        final_response = await team_lead.arun(
+        f"Summarize and integrate the following insights gathered using the full contract data:\n\n"
+        f"Legal Researcher:\n{research_response}\n\n"
+        f"Contract Analyst:\n{contract_response}\n\n"
+        f"Legal Strategist:\n{strategy_response}\n\n"
+        "Provide a structured legal analysis report that includes key terms, obligations, risks, and recommendations, with references to the document.",
+        stream=False,
+        )
+        content = _content(final_response)
+        memo[key] = content
+        while len(memo) > SPECIALIST_CACHE_SIZE:
+            memo.popitem(last=False)
+        return content
+
     def get_team_response(query):
         # First check if knowledge base has content
         try:
-            test_search = st.session_state.knowledge_base.search("contract agreement terms")
-            if not test_search:
+            chunk_count = count_doc_chunks(st.session_state.current_doc)
+            if chunk_count == 0:
                 return "No document content found in knowledge base. Please upload a PDF document first."
             
             # Debug: Show what was found
-            st.info(f"🔍 Knowledge base search found {len(test_search)} results. First result preview: {str(test_search[0])[:200]}...")
+            st.info(f"🔍 Knowledge base contains {chunk_count} chunks for {st.session_state.current_doc}.")
             
         except Exception as e:
             return f"Error accessing knowledge base: {e}. Please ensure document was uploaded successfully."
-        
-        research_response = legal_researcher.run(query)
-        contract_response = contract_analyst.run(query)
-        strategy_response = legal_strategist.run(query)
 
-        final_response = team_lead.run(
-        f"Summarize and integrate the following insights gathered using the full contract data:\n\n"
-        f"Legal Researcher:\n{research_response}\n\n"
-        f"Contract Analyst:\n{contract_response}\n\n"
-        f"Legal Strategist:\n{strategy_response}\n\n"
-        "Provide a structured legal analysis report that includes key terms, obligations, risks, and recommendations, with references to the document."
+        # Streamlit calls stay on the script thread; only the agent runs go to the background loop
+        return run_async(
+            get_team_response_async(
+                query, st.session_state.specialist_outputs, st.session_state.kb_version, current_doc_filter()
+            )
         )
-        return final_response
+
+    # All post-processing sections are produced by one structured team lead call
+    breakdown_prompt = (
+        "Based on the following legal analysis, produce every section below in a single response.\n"
+        "- client_view: the analysis rewritten focusing only on the receiving party (client)'s perspective.\n"
+        "- issuing_view: the analysis rewritten focusing only on the issuing party's perspective.\n"
+        "- critical_clauses: the most critical clauses, categorized into High Risk, Medium Risk, and Low Risk, as bullet points.\n"
+        "- strengths: only the strengths, one per line.\n"
+        "- weaknesses: only the weaknesses, one per line.\n"
+        "- recommendations: specific, actionable legal recommendations as bullet points.\n"
+        "Each field is a markdown string. Return strict JSON: "
+        "{{client_view, issuing_view, critical_clauses, strengths, weaknesses, recommendations}}.\n\n"
+        "Analysis:\n{content}"
+    )
+
+    llm_cache = get_llm_cache()
+
+    async def cached_run(agent, tag, prompt, doc, parse):
+        # Reuse the answer to an identical prompt for the same document. The prompt embeds the whole
+        # source analysis, so only an exact key is safe; no embedding call is needed to look it up.
+        key = hashlib.md5(f"{tag}:{doc}:{prompt}".encode()).hexdigest()
+        if key in llm_cache:
+            llm_cache.move_to_end(key)
+            return llm_cache[key]
+
+        response = await agent.arun(prompt, stream=False)
+        parsed = parse(_content(response))
+        # Only well-formed replies are cached, so a bad one is retried next time instead of replayed
+        if parsed is not None:
+            llm_cache[key] = parsed
+            while len(llm_cache) > LLM_CACHE_SIZE:
+                llm_cache.popitem(last=False)
+        return parsed
+
+    def parse_breakdown(content):
+        try:
+            sections = orjson.loads(content)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(sections, dict):
+            return None
+        return {
+            field: sections[field] if isinstance(sections.get(field), str) else ""
+            for field in BREAKDOWN_FIELDS
+        }
+
+    async def breakdown(response_content, doc):
+        sections = await cached_run(
+            breakdown_lead, "breakdown", breakdown_prompt.format(content=response_content), doc or "", parse_breakdown
+        )
+        return sections or {field: "" for field in BREAKDOWN_FIELDS}
 
 # Analysis Options
-if st.session_state.knowledge_base:
+if st.session_state.kb_id:
     st.header("🔍 Select Analysis Type")
     analysis_type = st.selectbox(
         "Choose Analysis Type:",
@@ -279,17 +785,26 @@ if st.session_state.knowledge_base:
         user_prompt = st.chat_input("Ask a legal question about your uploaded document...")
         if user_prompt:
             st.session_state.chat_messages.append({"role": "user", "content": user_prompt})
-            with st.spinner("Answering..."):
-                directive = (
-                    "Answer the user's question strictly and concisely based on the uploaded document. "
-                    "Provide only the direct answer in 3-5 sentences and avoid a long legal analysis. "
-                    "Cite document sections briefly if essential."
+            with st.chat_message("user"):
+                st.markdown(user_prompt)
+            directive = (
+                "Answer the user's question strictly and concisely based on the uploaded document. "
+                "Provide only the direct answer in 3-5 sentences and avoid a long legal analysis. "
+                "Cite document sections briefly if essential."
+            )
+            # Stream tokens into the chat bubble as they arrive instead of waiting for the full answer
+            chat_stream = legal_researcher.run(
+                f"{directive}\n\nQuestion: {user_prompt}", stream=True, knowledge_filters=current_doc_filter() or None
+            )
+            with st.chat_message("assistant"):
+                assistant_text = st.write_stream(
+                    chunk.content
+                    for chunk in chat_stream
+                    if chunk.event == RunEvent.run_content and isinstance(chunk.content, str)
                 )
-                chat_response = legal_researcher.run(f"{directive}\n\nQuestion: {user_prompt}")
-            assistant_text = getattr(chat_response, "content", None) or str(chat_response)
+            if not isinstance(assistant_text, str):
+                assistant_text = "".join(str(part) for part in assistant_text)
             st.session_state.chat_messages.append({"role": "assistant", "content": assistant_text})
-            with st.chat_message("assistant"):
-                st.markdown(assistant_text)
     else:
         predefined_queries = {
             "Contract Review": (
@@ -347,8 +862,17 @@ if st.session_state.knowledge_base:
 
         if response:
             # Handle both string responses and object responses with .content attribute
-            response_content = getattr(response, 'content', None) or str(response)
+            response_content = _content(response)
             if response_content:
+                # Reuse the parsed sections while the analysis they were built from is unchanged
+                cached_breakdown = st.session_state.get("analysis_breakdown")
+                if cached_breakdown and cached_breakdown[0] == response_content:
+                    results = cached_breakdown[1]
+                else:
+                    with st.spinner("Preparing perspectives and key points..."):
+                        results = run_async(breakdown(response_content, st.session_state.current_doc))
+                    st.session_state.analysis_breakdown = (response_content, results)
+
                 # ----------------------------
                 # Party Perspective Tabs
                 # ----------------------------
@@ -356,19 +880,11 @@ if st.session_state.knowledge_base:
 
                 with party_tabs[0]:
                     st.subheader("📑 Receiving Party (Client) Perspective")
-                    client_view = team_lead.run(
-                        f"Rewrite this analysis focusing only on the receiving party (client)'s perspective:\n{response_content}"
-                    )
-                    client_view_content = getattr(client_view, 'content', None) or str(client_view)
-                    st.markdown(client_view_content or "No client-specific analysis.")
+                    st.markdown(results["client_view"] or "No client-specific analysis.")
 
                 with party_tabs[1]:
                     st.subheader("📑 Issuing Party Perspective")
-                    issuing_view = team_lead.run(
-                        f"Rewrite this analysis focusing only on the issuing party's perspective:\n{response_content}"
-                    )
-                    issuing_view_content = getattr(issuing_view, 'content', None) or str(issuing_view)
-                    st.markdown(issuing_view_content or "No issuing-party-specific analysis.")
+                    st.markdown(results["issuing_view"] or "No issuing-party-specific analysis.")
 
                 # ----------------------------
                 # Section Tabs (Analysis / Key Points / Recommendations)
@@ -381,13 +897,8 @@ if st.session_state.knowledge_base:
                         st.markdown(response_content or "No response generated.")
 
                     with st.expander("📜 Critical Clauses"):
-                        clauses = team_lead.run(
-                            f"Extract the most critical clauses from this legal document. "
-                            f"Categorize them into High Risk, Medium Risk, and Low Risk. Format as bullet points:\n{response_content}"
-                        )
-                        clauses_content = getattr(clauses, 'content', None) or str(clauses)
-                        if clauses_content:
-                            for line in clauses_content.split("\n"):
+                        if results["critical_clauses"]:
+                            for line in results["critical_clauses"].split("\n"):
                                 if "High Risk" in line:
                                     st.markdown(
                                         f"<div style='padding:10px; border-radius:8px; background:#fee2e2; border-left:5px solid #dc2626; margin:5px 0;'>"
@@ -413,12 +924,8 @@ if st.session_state.knowledge_base:
                     col1, col2 = st.columns(2)
                     with col1:
                         st.markdown("### ✅ Strengths")
-                        strengths = team_lead.run(
-                            f"List only the strengths from this analysis:\n{response_content}"
-                        )
-                        strengths_content = getattr(strengths, 'content', None) or str(strengths)
-                        if strengths_content:
-                            for s in strengths_content.split("\n"):
+                        if results["strengths"]:
+                            for s in results["strengths"].split("\n"):
                                 if s.strip():
                                     st.markdown(f"✅ {s}")
                         else:
@@ -426,12 +933,8 @@ if st.session_state.knowledge_base:
 
                     with col2:
                         st.markdown("### ⚠️ Weaknesses")
-                        weaknesses = team_lead.run(
-                            f"List only the weaknesses from this analysis:\n{response_content}"
-                        )
-                        weaknesses_content = getattr(weaknesses, 'content', None) or str(weaknesses)
-                        if weaknesses_content:
-                            for w in weaknesses_content.split("\n"):
+                        if results["weaknesses"]:
+                            for w in results["weaknesses"].split("\n"):
                                 if w.strip():
                                     st.markdown(f"⚠️ {w}")
                         else:
@@ -440,12 +943,8 @@ if st.session_state.knowledge_base:
                 # --- Recommendations Section ---
                 with tabs[2]:
                     st.markdown("### 🎯 Actionable Recommendations")
-                    recommendations_response = team_lead.run(
-                        f"Provide specific, actionable legal recommendations in bullet points based on this analysis:\n{response_content}"
-                    )
-                    recommendations_content = getattr(recommendations_response, 'content', None) or str(recommendations_response)
-                    if recommendations_content:
-                        for rec in recommendations_content.split("\n"):
+                    if results["recommendations"]:
+                        for rec in results["recommendations"].split("\n"):
                             if rec.strip():
                                 st.markdown(f"💡 {rec}")
                     else: